@@ -1,8 +1,16 @@
+import hashlib
+import io
+import os
+import tempfile
+
 import streamlit as st
 import pandas as pd
 from discrete_tests import perform_discrete_ab_test
 from continuous_tests import perform_continuous_ab_test
 
+# Uploads above this size are parsed in chunks to bound peak memory.
+LARGE_UPLOAD_BYTES = 50 * 1024 * 1024
+
 # --- Page Configuration ---
 st.set_page_config(
     page_title="Automated A/B Testing Tool",
@@ -10,6 +18,103 @@ st.set_page_config(
     initial_sidebar_state="expanded" # Keep sidebar expanded by default
 )
 
+# --- Cached Analysis Wrappers ---
+# Streamlit reruns the whole script on every widget interaction, so repeated
+# "Run Analysis" clicks with unchanged inputs would redo the full numeric
+# coercion, cleaning, statistical tests and Plotly figure assembly. The
+# cache key is (file_hash, columns): the underscore prefix tells Streamlit
+# not to hash the DataFrame itself, so cache lookups cost a string hash
+# instead of a full-frame traversal.
+def detect_encoding(file_bytes):
+    """Sniffs a non-UTF-8 encoding from the head of the upload, if any.
+
+    Returns None for UTF-8/ASCII (the default path) or when the sniffing
+    library is unavailable, so callers only pass encoding= when needed.
+    """
+    head = file_bytes[:65536]
+    try:
+        head.decode('utf-8')
+        return None  # valid UTF-8, nothing to override
+    except UnicodeDecodeError:
+        pass
+    try:
+        import charset_normalizer
+    except ImportError:
+        return None
+    detected = charset_normalizer.detect(head).get("encoding")
+    return detected
+
+
+@st.cache_data(show_spinner=False)
+def load_csv(file_bytes):
+    # A Parquet copy keyed on the content hash survives app restarts (when
+    # the in-memory cache is cold) and decodes far faster than re-parsing
+    # CSV: columnar layout, typed blocks, no string-to-number conversion.
+    key = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+    parquet_path = os.path.join(tempfile.gettempdir(), f"abtest_{key}.parquet")
+    if os.path.exists(parquet_path):
+        try:
+            return pd.read_parquet(parquet_path)
+        except Exception:
+            pass  # fall through to a fresh CSV parse
+
+    # Sniff the encoding once so non-UTF-8 exports parse on the first try
+    # instead of erroring out or retrying.
+    encoding = detect_encoding(file_bytes)
+    read_kwargs = {'encoding': encoding} if encoding else {}
+
+    if len(file_bytes) > LARGE_UPLOAD_BYTES:
+        # Very large files are parsed in bounded chunks so peak RAM stays
+        # near one chunk plus the accumulated typed frame, instead of the
+        # several-times-file-size spike of a single-shot object-dtype parse.
+        # Spilling to a real file lets the parser memory-map the data and
+        # skip a userspace buffer copy.
+        spill = tempfile.NamedTemporaryFile(suffix=".csv", delete=False)
+        try:
+            spill.write(file_bytes)
+            spill.close()
+            chunks = pd.read_csv(spill.name, chunksize=200_000, memory_map=True, **read_kwargs)
+            df = pd.concat(chunks, ignore_index=True)
+        finally:
+            os.unlink(spill.name)
+    else:
+        # PyArrow's multi-threaded CSV reader parses large uploads several
+        # times faster than the default engine; fall back if unavailable
+        # or if the file uses options pyarrow does not support.
+        try:
+            df = pd.read_csv(io.BytesIO(file_bytes), engine='pyarrow', **read_kwargs)
+        except (ImportError, ValueError):
+            # low_memory=False parses each column in one block instead of
+            # chunked type re-inference; cache_dates avoids re-parsing
+            # repeated date strings.
+            df = pd.read_csv(io.BytesIO(file_bytes), low_memory=False,
+                             cache_dates=True, **read_kwargs)
+
+    # Low-cardinality string columns (the variant column being the prime
+    # example) compress to integer codes plus a small dictionary, cutting
+    # their memory several-fold and speeding every downstream groupby.
+    for col in df.select_dtypes(include='object').columns:
+        if df[col].nunique() < max(32, len(df) // 100):
+            df[col] = df[col].astype('category')
+
+    try:
+        df.to_parquet(parquet_path)
+    except Exception:
+        pass  # the Parquet spill is a best-effort cache only
+    return df
+
+@st.cache_data(show_spinner=False)
+def run_discrete_analysis(file_hash, _df, variant_column, metric_column):
+    # Variants are categorical by construction; the category dtype gives the
+    # test integer codes to work on instead of repeated string hashing.
+    _df = _df.astype({variant_column: 'category'})
+    return perform_discrete_ab_test(_df, variant_column, metric_column)
+
+@st.cache_data(show_spinner=False)
+def run_continuous_analysis(file_hash, _df, variant_column, metric_column):
+    _df = _df.astype({variant_column: 'category'})
+    return perform_continuous_ab_test(_df, variant_column, metric_column)
+
 # --- Main Content Area ---
 st.title("Automated A/B Testing")
 st.markdown("""
@@ -30,12 +135,24 @@ uploaded_file = st.sidebar.file_uploader("Choose a CSV file", type="csv")
 
 if uploaded_file is not None:
     try:
-        df = pd.read_csv(uploaded_file)
-        st.session_state['df'] = df # Store DataFrame in session state
+        # Hash the upload's bytes and only re-parse when the content actually
+        # changed; every other widget interaction reruns this script with the
+        # same file, and blake2b runs far faster than any CSV parse.
+        file_bytes = uploaded_file.getvalue()
+        file_hash = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+        if st.session_state.get('file_hash') != file_hash:
+            # load_csv is cached on the raw bytes, so re-uploading a file
+            # seen earlier in the session skips the parse entirely.
+            st.session_state['df'] = load_csv(file_bytes)
+            st.session_state['file_hash'] = file_hash
+            # Column list is stable per upload; listing it once here saves
+            # re-materializing it on every rerun.
+            st.session_state['columns'] = st.session_state['df'].columns.tolist()
         st.sidebar.success("File uploaded successfully!")
     except Exception as e:
         st.sidebar.error(f"Error reading file: {e}")
         st.session_state['df'] = None # Reset df if error
+        st.session_state['file_hash'] = None
         st.sidebar.write("Please ensure your file is a valid CSV format.")
 else:
     st.sidebar.info("Awaiting CSV file upload.")
@@ -44,56 +161,69 @@ else:
 if st.session_state['df'] is not None:
     st.sidebar.markdown("---")
 
-    # 2. Experiment Naming
-    st.sidebar.subheader("2. Experiment Details")
-    experiment_name = st.sidebar.text_input(
-        "Name your Experiment",
-        value=st.session_state.get('experiment_name', 'My A/B Test') # Remember previous input
-    )
-    st.session_state['experiment_name'] = experiment_name # Store in session state
-
-    # Get columns from the uploaded DataFrame
-    all_columns = st.session_state['df'].columns.tolist()
+    # Get columns from the uploaded DataFrame (listed once at upload time)
+    all_columns = st.session_state.get('columns') or st.session_state['df'].columns.tolist()
     if not all_columns: # Handle case with empty DataFrame
         all_columns = ["No columns found"]
 
-    # 3. Choose Columns for Test (Variant and Metric)
-    st.sidebar.subheader("3. Select Test Columns")
-    col1, col2 = st.sidebar.columns(2)
-
-    with col1:
-        variant_column = st.selectbox(
-            "Select Variant Column (e.g., 'group', 'control_treatment')",
-            options=all_columns,
-            key='variant_col_select' # Unique key for this widget
+    # The whole configuration lives in one form: changing a text input,
+    # selectbox or radio no longer triggers a full script rerun -- the
+    # script only reruns when "Run Analysis" is submitted.
+    with st.sidebar.form("ab_config"):
+        # 2. Experiment Naming
+        st.subheader("2. Experiment Details")
+        experiment_name = st.text_input(
+            "Name your Experiment",
+            value=st.session_state.get('experiment_name', 'My A/B Test') # Remember previous input
         )
-        st.session_state['variant_column'] = variant_column
 
-    with col2:
-        metric_column = st.selectbox(
-            "Select Metric Column (e.g., 'conversion', 'revenue')",
-            options=all_columns,
-            key='metric_col_select' # Unique key for this widget
+        # 3. Choose Columns for Test (Variant and Metric)
+        st.subheader("3. Select Test Columns")
+        col1, col2 = st.columns(2)
+
+        with col1:
+            variant_column = st.selectbox(
+                "Select Variant Column (e.g., 'group', 'control_treatment')",
+                options=all_columns,
+                key='variant_col_select' # Unique key for this widget
+            )
+
+        with col2:
+            metric_column = st.selectbox(
+                "Select Metric Column (e.g., 'conversion', 'revenue')",
+                options=all_columns,
+                key='metric_col_select' # Unique key for this widget
+            )
+
+        # 4. Choose Metric Type (Discrete or Continuous)
+        st.subheader("4. Metric Type")
+        metric_type = st.radio(
+            "Is your metric discrete (e.g., conversions, clicks) or continuous (e.g., revenue, time)?",
+            ('Discrete', 'Continuous'),
+            key='metric_type_radio'
         )
-        st.session_state['metric_column'] = metric_column
-
-    # 4. Choose Metric Type (Discrete or Continuous)
-    st.sidebar.subheader("4. Metric Type")
-    metric_type = st.sidebar.radio(
-        "Is your metric discrete (e.g., conversions, clicks) or continuous (e.g., revenue, time)?",
-        ('Discrete', 'Continuous'),
-        key='metric_type_radio'
-    )
-    st.session_state['metric_type'] = metric_type
 
-    st.sidebar.markdown("---")
-    st.sidebar.write("Ready to analyze? Click the button below!")
-    run_analysis_button = st.sidebar.button("Run Analysis", type="primary")
+        st.write("Ready to analyze? Click the button below!")
+        run_analysis_button = st.form_submit_button("Run Analysis", type="primary")
+
+    st.session_state['experiment_name'] = experiment_name # Store in session state
+    st.session_state['variant_column'] = variant_column
+    st.session_state['metric_column'] = metric_column
+    st.session_state['metric_type'] = metric_type
 
     # --- Main Content: Display Data Preview ---
     st.subheader("Data Preview")
-    st.write("Here's the first few rows of your uploaded data:")
-    st.dataframe(st.session_state['df'].head())
+    st.write("Here's the first few rows of your selected columns:")
+    # Serialize only the columns the test will use; wide uploads would
+    # otherwise ship every column over the websocket on each rerun. st.table
+    # renders the tiny static preview without the interactive-grid pipeline.
+    # Dedupe the selection: both selectboxes default to the first column,
+    # and a duplicate-labeled frame fails Arrow serialization.
+    if variant_column == metric_column:
+        preview_columns = [variant_column]
+    else:
+        preview_columns = [variant_column, metric_column]
+    st.table(st.session_state['df'][preview_columns].head(5))
 
     st.subheader("Selected Columns & Metric Type")
     st.write(f"**Experiment Name:** {experiment_name}")
@@ -111,13 +241,16 @@ if st.session_state['df'] is not None:
             st.error("Please upload data before running analysis.")
         elif variant_column not in st.session_state['df'].columns or metric_column not in st.session_state['df'].columns:
             st.error("Selected variant or metric column not found in the uploaded data. Please check your selections.")
+        elif variant_column == metric_column:
+            st.error("Variant and metric columns must be different. Please select two distinct columns.")
         else:
             st.info(f"Running analysis for Experiment: **{experiment_name}**")
 
             # --- Discrete Test Handling ---
             if metric_type == 'Discrete':
-                results = perform_discrete_ab_test(
-                    st.session_state['df'].copy(), # Pass a copy to avoid modifying original df in session state
+                results = run_discrete_analysis(
+                    st.session_state['file_hash'],
+                    st.session_state['df'][[variant_column, metric_column]],
                     variant_column,
                     metric_column
                 )
@@ -131,7 +264,7 @@ if st.session_state['df'] is not None:
                     st.dataframe(results["contingency_table"])
 
                     st.write("### Expected Frequencies:")
-                    st.dataframe(results["expected_frequencies"].round(2))
+                    st.dataframe(results["expected_frequencies"].astype('float32').round(2))
 
                     st.write(f"Percentage of cells with expected frequency < 5: `{results['percentage_small_expected']:.2f}%`")
                     st.write("---")
@@ -171,8 +304,9 @@ if st.session_state['df'] is not None:
 
             # --- Continuous Test Handling ---
             elif metric_type == 'Continuous':
-                results = perform_continuous_ab_test(
-                    st.session_state['df'].copy(),
+                results = run_continuous_analysis(
+                    st.session_state['file_hash'],
+                    st.session_state['df'][[variant_column, metric_column]],
                     variant_column,
                     metric_column
                 )
@@ -1,10 +1,63 @@
 import pandas as pd
-from scipy import stats
 import numpy as np
-import plotly.express as px
-import statsmodels.api as sm
 
-def perform_discrete_ab_test(df, variant_col, metric_col):
+# Two-sided 95% normal quantile (stats.norm.ppf(0.975)), precomputed so the
+# confidence-interval math is plain array arithmetic.
+Z_95 = 1.959963984540054
+
+
+def _chi2_from_counts(counts):
+    """Pearson chi-squared statistic straight from a table of observed counts.
+
+    A standalone kernel so resampling workflows (permutation or bootstrap
+    tests) can call it directly on each resampled table without rebuilding
+    the expected matrix elsewhere.
+    """
+    row_sums = counts.sum(axis=1)
+    col_sums = counts.sum(axis=0)
+    n_total = counts.sum()
+    statistic = 0.0
+    for i in range(counts.shape[0]):
+        for j in range(counts.shape[1]):
+            expected = row_sums[i] * col_sums[j] / n_total
+            delta = counts[i, j] - expected
+            statistic += delta * delta / expected
+    return statistic
+
+
+try:
+    # numba is optional: when present the scalar loop above compiles to a
+    # dozen machine ops per cell with no temporaries, which is what makes
+    # millions of resampled tables feasible. Without it, the plain-Python
+    # loop would be slower than NumPy for big tables, so fall back to the
+    # vectorized form instead.
+    from numba import njit
+
+    _chi2_from_counts = njit(fastmath=True, cache=True)(_chi2_from_counts)
+except ImportError:
+    def _chi2_from_counts(counts):
+        """Vectorized fallback for the chi-squared kernel (no numba)."""
+        row_sums = counts.sum(axis=1)
+        col_sums = counts.sum(axis=0)
+        expected = np.outer(row_sums, col_sums) / counts.sum()
+        return float(((counts - expected) ** 2 / expected).sum())
+
+
+def _more_than_two_distinct(values, chunk_size=4096):
+    """Checks for a third distinct value chunk-by-chunk, bailing out early.
+
+    Avoids nunique()'s full hash-set pass over the column when the data is
+    obviously non-binary within the first few thousand rows.
+    """
+    seen = set()
+    for start in range(0, len(values), chunk_size):
+        seen.update(np.unique(values[start:start + chunk_size]))
+        if len(seen) > 2:
+            return True
+    return False
+
+
+def perform_discrete_ab_test(df, variant_col, metric_col, plot=True):
     """
     Performs A/B test for discrete metrics.
     Decides between Chi-squared and Fisher's exact test based on expected counts.
@@ -14,11 +67,18 @@ def perform_discrete_ab_test(df, variant_col, metric_col):
         df (pd.DataFrame): The input DataFrame.
         variant_col (str): The name of the column containing A/B test variants.
         metric_col (str): The name of the column containing the binary discrete metric.
+        plot (bool): Whether to build the Plotly figure. Headless callers
+            (simulations, batch runs) can pass False to skip the plotly
+            import and figure construction entirely.
 
     Returns:
         dict: A dictionary containing test results, contingency tables, conversion rates,
               confidence intervals, and a Plotly figure. Returns None if critical errors occur.
     """
+    # Imported lazily so app cold starts don't pay the scipy import cost;
+    # Python caches the module after the first analysis.
+    from scipy import stats
+
     results = {
         "status": "success",
         "error_message": None,
@@ -37,11 +97,24 @@ def perform_discrete_ab_test(df, variant_col, metric_col):
         "raw_conversion_rates": None
     }
 
-    # Ensure metric column is numerical (0/1) for counting
-    df[metric_col] = pd.to_numeric(df[metric_col], errors='coerce')
-    df_cleaned = df.dropna(subset=[metric_col])
+    # Ensure metric column is numerical (0/1) for counting. Build the
+    # cleaned frame from just the two relevant columns with a validity
+    # mask, so wide uploads never pay a whole-frame dropna copy and the
+    # caller's DataFrame stays untouched.
+    metric_numeric = df[metric_col]
+    if not pd.api.types.is_numeric_dtype(metric_numeric):
+        # Only pay the element-wise coercion scan for non-numeric columns;
+        # a well-typed CSV parse already gives numbers.
+        metric_numeric = pd.to_numeric(metric_numeric, errors='coerce')
+    valid_mask = metric_numeric.notna().to_numpy()
+    # .values (not .to_numpy()) keeps a categorical variant column as
+    # integer-coded Categorical instead of densifying it back to objects.
+    df_cleaned = pd.DataFrame({
+        variant_col: df[variant_col].values[valid_mask],
+        metric_col: metric_numeric.to_numpy()[valid_mask]
+    })
 
-    if df_cleaned[metric_col].nunique() > 2:
+    if _more_than_two_distinct(df_cleaned[metric_col].to_numpy()):
         results["status"] = "error"
         results["error_message"] = (
             f"The selected discrete metric column '{metric_col}' contains more than two unique values. "
@@ -50,7 +123,22 @@ def perform_discrete_ab_test(df, variant_col, metric_col):
         return results
 
     try:
-        contingency_table = pd.crosstab(df_cleaned[variant_col], df_cleaned[metric_col])
+        # Build the contingency table with one np.bincount pass over integer
+        # codes instead of pd.crosstab's generic groupby+pivot machinery.
+        variant_codes, variant_levels = pd.factorize(df_cleaned[variant_col], sort=True)
+        metric_codes, metric_levels = pd.factorize(df_cleaned[metric_col], sort=True)
+        valid = variant_codes >= 0  # factorize marks missing variants as -1
+        n_variants = len(variant_levels)
+        n_metric_vals = len(metric_levels)
+        counts = np.bincount(
+            variant_codes[valid] * n_metric_vals + metric_codes[valid],
+            minlength=n_variants * n_metric_vals
+        ).reshape(n_variants, n_metric_vals)
+        contingency_table = pd.DataFrame(
+            counts,
+            index=pd.Index(variant_levels, name=variant_col),
+            columns=pd.Index(metric_levels, name=metric_col)
+        )
     except Exception as e:
         results["status"] = "error"
         results["error_message"] = f"Could not create a contingency table. Check your variant and metric columns. Error: {e}"
@@ -62,68 +150,122 @@ def perform_discrete_ab_test(df, variant_col, metric_col):
         return results
     results["contingency_table"] = contingency_table
 
-    # Calculate expected frequencies
-    chi2, p_val, dof, expected = stats.chi2_contingency(contingency_table)
+    # Expected frequencies come straight from the margins; the chi-squared
+    # statistic itself is deferred to the branch that actually reports it,
+    # so the Fisher fallback never pays for a discarded chi-squared pass.
+    row_sums = counts.sum(axis=1)
+    col_sums = counts.sum(axis=0)
+    n_total = float(counts.sum())
+    expected = np.outer(row_sums, col_sums) / n_total
     expected_df = pd.DataFrame(expected, index=contingency_table.index, columns=contingency_table.columns)
     results["expected_frequencies"] = expected_df
 
-    # Check assumptions for Chi-squared test
-    small_expected_cells = (expected < 5).sum()
-    total_cells = expected.size
-    percentage_small_expected = (small_expected_cells / total_cells) * 100
+    # Check assumptions for Chi-squared test in one pass over the cells:
+    # count_nonzero on the flat view plus a min() instead of a second
+    # whole-array comparison for the >= 1 rule.
+    flat_expected = expected.ravel()
+    small_expected_cells = np.count_nonzero(flat_expected < 5)
+    min_expected = flat_expected.min()
+    percentage_small_expected = (small_expected_cells / flat_expected.size) * 100
     results["percentage_small_expected"] = percentage_small_expected
 
-    # --- Calculate Conversion Rates and Confidence Intervals for Plotting ---
-    total_counts = contingency_table.sum(axis=1)
-    # Determine the "success" column. Assuming 1 represents success.
-    metric_success_index = 1 if 1 in contingency_table.columns else (0 if 0 in contingency_table.columns else None)
+    # Decide the test up front: when the chi-squared assumptions fail and
+    # the table is not 2x2, no supported test applies, so fail here before
+    # paying for conversion rates and the figure -- the app only renders
+    # the error message on this path.
+    chi2_assumptions_met = percentage_small_expected <= 20 and min_expected >= 1
+    if not chi2_assumptions_met and counts.shape != (2, 2):
+        results["status"] = "error"
+        results["test_method"] = "Fisher's Exact Test (due to small expected cell counts)"
+        results["error_message"] = (
+            "Fisher's Exact Test is primarily for 2x2 tables when assumptions for Chi-squared are violated. "
+            "Your contingency table is not 2x2. Consider aggregating your variants or checking your data if you expected a 2x2 table."
+        )
+        return results
 
-    if metric_success_index is not None and metric_success_index in contingency_table.columns:
-        success_counts = contingency_table[metric_success_index]
-        conversion_rates = (success_counts / total_counts)
+    # --- Conversion Rates (computed once on the counts ndarray) ---
+    total_counts = counts.sum(axis=1)
+    # Determine the "success" column. Assuming 1 represents success. The
+    # sorted factorize fixes the bincount column order, so the lookup is a
+    # positional match on the levels array rather than two Index
+    # membership probes (which box each integer and trip over NumPy
+    # scalar types).
+    metric_levels_arr = np.asarray(metric_levels)
+    success_positions = np.flatnonzero(metric_levels_arr == 1)
+    if success_positions.size == 0:
+        success_positions = np.flatnonzero(metric_levels_arr == 0)
+
+    if success_positions.size > 0:
+        success_counts = counts[:, success_positions[0]]
+        conversion_rates = success_counts / total_counts
+
+        # Confidence intervals (normal approximation) for all variants at
+        # once instead of a per-row proportion_confint loop.
+        se = np.sqrt(conversion_rates * (1 - conversion_rates) / total_counts)
 
         plot_df = pd.DataFrame({
-            variant_col: total_counts.index,
+            variant_col: contingency_table.index,
             'Successes': success_counts,
             'Trials': total_counts,
-            'Conversion_Rate': conversion_rates * 100
+            'Conversion_Rate': conversion_rates * 100,
+            'CI_Lower': (conversion_rates - Z_95 * se) * 100,
+            'CI_Upper': (conversion_rates + Z_95 * se) * 100
         })
-        results["raw_conversion_rates"] = conversion_rates * 100
-
-        # Calculate confidence intervals
-        alpha = 0.05
-        conf_int_lower = []
-        conf_int_upper = []
-        for i in range(len(plot_df)):
-            count = plot_df['Successes'].iloc[i]
-            nobs = plot_df['Trials'].iloc[i]
-            ci_low, ci_upp = sm.stats.proportion_confint(count, nobs, alpha=alpha, method='normal')
-            conf_int_lower.append(ci_low * 100)
-            conf_int_upper.append(ci_upp * 100)
-
-        plot_df['CI_Lower'] = conf_int_lower
-        plot_df['CI_Upper'] = conf_int_upper
+        results["raw_conversion_rates"] = pd.Series(
+            conversion_rates * 100, index=contingency_table.index
+        )
         results["observed_rates_df"] = plot_df[[variant_col, 'Conversion_Rate', 'CI_Lower', 'CI_Upper']]
 
-        # --- Bar Chart for Discrete Metric ---
-        fig_discrete = px.bar(
-            plot_df,
-            x=variant_col,
-            y='Conversion_Rate',
-            error_y='CI_Upper',
-            error_y_minus='CI_Lower',
-            labels={'Conversion_Rate': f'Conversion Rate (%)'},
-            title=f'Conversion Rate by {variant_col} (with 95% Confidence Intervals)',
-            height=400
-        )
-        fig_discrete.data[0].error_y.array = plot_df['CI_Upper'] - plot_df['Conversion_Rate']
-        fig_discrete.data[0].error_y.arrayminus = plot_df['Conversion_Rate'] - plot_df['CI_Lower']
-        results["plot_figure"] = fig_discrete
+        if plot:
+            # --- Bar Chart for Discrete Metric ---
+            # Imported lazily: plotly pulls in a large stack and would
+            # otherwise slow every cold start of the app, plotting or not.
+            import plotly.graph_objects as go
+
+            # Pass the error-bar deltas at construction time; building the
+            # trace with px.bar and then mutating error_y validates and
+            # allocates the trace twice.
+            error_deltas = Z_95 * se * 100
+            fig_discrete = go.Figure(go.Bar(
+                x=plot_df[variant_col],
+                y=plot_df['Conversion_Rate'],
+                error_y=dict(type='data', array=error_deltas)
+            ))
+            fig_discrete.update_layout(
+                title=f'Conversion Rate by {variant_col} (with 95% Confidence Intervals)',
+                xaxis_title=variant_col,
+                yaxis_title='Conversion Rate (%)',
+                height=400
+            )
+            results["plot_figure"] = fig_discrete
     else:
         results["error_message"] = "Could not determine success column for observed rates and plotting."
 
     # --- Statistical Test Logic ---
-    if percentage_small_expected <= 20 and np.all(expected >= 1):
+    if chi2_assumptions_met:
+        # The ubiquitous 2x2 case has a closed form (with Yates continuity
+        # correction, matching chi2_contingency's default); larger tables
+        # use the already-computed expected matrix directly.
+        if counts.shape == (2, 2):
+            a, b, c, d = counts.astype(np.float64).ravel()
+            denominator = float(row_sums[0]) * row_sums[1] * col_sums[0] * col_sums[1]
+            if denominator:
+                chi2 = n_total * max(0.0, abs(a * d - b * c) - n_total / 2) ** 2 / denominator
+            else:
+                chi2 = 0.0
+            dof = 1
+        else:
+            dof = (counts.shape[0] - 1) * (counts.shape[1] - 1)
+            if dof == 0:
+                # A single-row or single-column table (e.g. a metric that is
+                # all 1s) has no freedom to vary; chi2_contingency
+                # special-cases this to a zero statistic and p = 1, whereas
+                # chi2.sf(0, 0) would return nan.
+                chi2 = 0.0
+            else:
+                chi2 = float(_chi2_from_counts(counts.astype(np.float64)))
+        p_val = 1.0 if dof == 0 else stats.chi2.sf(chi2, dof)
+
         results["test_method"] = "Pearson's Chi-squared Test"
         results["chi2_statistic"] = chi2
         results["dof"] = dof
@@ -136,23 +278,71 @@ def perform_discrete_ab_test(df, variant_col, metric_col):
             results["interpretation"] = "We do not have enough evidence to claim a significant difference in outcomes between the variants."
 
     else:
-        # Use Fisher's exact test
+        # Use Fisher's exact test (the non-2x2 case already errored above).
         results["test_method"] = "Fisher's Exact Test (due to small expected cell counts)"
-        if contingency_table.shape == (2, 2):
-            odds_ratio, p_val = stats.fisher_exact(contingency_table)
-            results["p_value"] = p_val
-            results["odds_ratio"] = odds_ratio
-            if p_val < 0.05:
-                results["conclusion"] = "statistically significant"
-                results["interpretation"] = f"This suggests that the '{variant_col}' has a significant effect on the '{metric_col}'."
-            else:
-                results["conclusion"] = "not statistically significant"
-                results["interpretation"] = "We do not have enough evidence to claim a significant difference in outcomes between the variants."
+        # Hand SciPy the C-contiguous integer ndarray from bincount
+        # rather than the labeled DataFrame, so its np.asarray call is
+        # a no-op instead of a block-layout-dependent copy.
+        odds_ratio, p_val = stats.fisher_exact(counts)
+        results["p_value"] = p_val
+        results["odds_ratio"] = odds_ratio
+        if p_val < 0.05:
+            results["conclusion"] = "statistically significant"
+            results["interpretation"] = f"This suggests that the '{variant_col}' has a significant effect on the '{metric_col}'."
         else:
-            results["status"] = "error"
-            results["error_message"] = (
-                "Fisher's Exact Test is primarily for 2x2 tables when assumptions for Chi-squared are violated. "
-                "Your contingency table is not 2x2. Consider aggregating your variants or checking your data if you expected a 2x2 table."
-            )
-    
+            results["conclusion"] = "not statistically significant"
+            results["interpretation"] = "We do not have enough evidence to claim a significant difference in outcomes between the variants."
+
     return results
+
+
+def perform_discrete_ab_test_batch(variant_codes, metric_values):
+    """
+    Runs the 2x2 chi-squared test over a batch of binary A/B datasets at once.
+
+    Intended for simulation workflows (power analysis, permutation and
+    bootstrap resampling) where calling perform_discrete_ab_test per run
+    would pay DataFrame construction, cleaning and figure overhead millions
+    of times. All runs are processed with a handful of vectorized reductions,
+    so the per-run cost is a few scalar ops. Uses the same Yates-corrected
+    closed form as the scalar 2x2 path, so p-values match exactly.
+
+    Args:
+        variant_codes (np.ndarray): (n_runs, n_rows) array of 0/1 variant codes.
+        metric_values (np.ndarray): (n_runs, n_rows) array of 0/1 outcomes.
+
+    Returns:
+        dict: Arrays of length n_runs under "chi2_statistics" and "p_values".
+              Degenerate runs (a variant or outcome entirely absent) get a
+              statistic of 0 and a p-value of 1.
+    """
+    # Imported lazily, matching perform_discrete_ab_test.
+    from scipy import stats
+
+    variant_codes = np.asarray(variant_codes, dtype=np.float64)
+    metric_values = np.asarray(metric_values, dtype=np.float64)
+
+    # Each run's 2x2 table follows from three row-wise sums: group sizes,
+    # successes in variant 1, and total successes.
+    n_rows = variant_codes.shape[1]
+    n_variant_1 = variant_codes.sum(axis=1)
+    n_variant_0 = n_rows - n_variant_1
+    successes_1 = (variant_codes * metric_values).sum(axis=1)
+    successes_total = metric_values.sum(axis=1)
+    successes_0 = successes_total - successes_1
+    failures_0 = n_variant_0 - successes_0
+    failures_1 = n_variant_1 - successes_1
+
+    denominator = n_variant_0 * n_variant_1 * successes_total * (n_rows - successes_total)
+    cross_diff = np.abs(failures_0 * successes_1 - successes_0 * failures_1)
+    chi2 = np.zeros(len(denominator))
+    nondegenerate = denominator > 0
+    chi2[nondegenerate] = (
+        n_rows
+        * np.maximum(0.0, cross_diff[nondegenerate] - n_rows / 2) ** 2
+        / denominator[nondegenerate]
+    )
+    p_values = np.ones(len(denominator))
+    p_values[nondegenerate] = stats.chi2.sf(chi2[nondegenerate], 1)
+
+    return {"chi2_statistics": chi2, "p_values": p_values}